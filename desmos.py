@@ -13,7 +13,8 @@ bl_info = {
 
 # Copyright (C) 2023: Ezra Oppenheimer, ezra.oppenheimer@gmail.com
 
-import bpy, bmesh, math, json, os, time
+import bpy, bmesh, math, json, os, time, hashlib
+import numpy as np
 
 from bpy.props import (
     EnumProperty,
@@ -21,10 +22,13 @@ from bpy.props import (
     BoolProperty,
     FloatProperty,
     IntProperty,
+    FloatVectorProperty,
 )
 from bpy_extras.io_utils import (
     ExportHelper
 )
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
 
 
 class ExportDESMOS(bpy.types.Operator, ExportHelper):
@@ -41,6 +45,7 @@ class ExportDESMOS(bpy.types.Operator, ExportHelper):
         items=(
             ("TXT", "Desmos Expressions (.txt)", "Inject the LaTeX equations per each expression"),
             ("JSON", "Desmos JSON (.json)", "Inject via JavaScript using only Calc.setState()"),
+            ("PATCH", "Desmos Patch (.js)", "Inject via JavaScript, only updating the tables that changed since the last export to this file"),
         ),
         default="TXT",
     )
@@ -59,6 +64,35 @@ class ExportDESMOS(bpy.types.Operator, ExportHelper):
     )
     
     
+    # Shard Settings
+    use_shards: BoolProperty(
+        name="Split Into Shards",
+        description="Write the objects into separate files next to an index file, so they can be pasted one at a time",
+        default=False,
+    )
+    type_shards: EnumProperty(
+        name="Shard By",
+        description="Choose how the objects are split between the files",
+        items=(
+            ("OBJECT", "Object", "One file per object. Re-exporting a single object only replaces its own file (enable Object Names to keep its variables the same)"),
+            ("SIZE", "Size", "Group the objects into files of roughly the shard size"),
+        ),
+        default="OBJECT",
+    )
+    shard_size: FloatProperty(
+        name="Shard Size (MB)",
+        description="The approximate size of each file when sharding by size",
+        min=0.1,
+        soft_max=100.0,
+        default=5.0,
+    )
+    use_shard_update: BoolProperty(
+        name="Keep Other Shards",
+        description="Only replace the shards of the selected objects, and keep the other shards listed in the index. Else the index only lists this export",
+        default=False,
+    )
+    
+    
     # Geometry Settings
     use_vertices: BoolProperty(
         name="Vertices",
@@ -90,11 +124,75 @@ class ExportDESMOS(bpy.types.Operator, ExportHelper):
         description="Export face material indices (requires Faces)",
         default=False,
     )
+    use_colors: BoolProperty(
+        name="Colors",
+        description="Export the average color of each face as an index into a small color palette (requires Faces)",
+        default=False,
+    )
+    type_color_source: EnumProperty(
+        name="Color Source",
+        description="Choose where the face colors are taken from",
+        items=(
+            ("ATTRIBUTE", "Color Attribute", "Average the active color attribute (vertex paint) over each face"),
+            ("TEXTURE", "Image Texture", "Sample the image texture of each face's material at its UVs"),
+        ),
+        default="ATTRIBUTE",
+    )
+    color_palette_size: IntProperty(
+        name="Palette Size",
+        description="The number of colors that the face colors are reduced to",
+        min=1,
+        max=256,
+        default=16,
+    )
+    use_edges: BoolProperty(
+        name="Edges",
+        description="Export every unique edge once as a pair of vertex indices, for drawing wireframes",
+        default=False,
+    )
+    type_edges: EnumProperty(
+        name="Edge Filter",
+        description="Choose which edges to export",
+        items=(
+            ("ALL", "All Edges", "Export every unique edge of the mesh"),
+            ("BOUNDARY", "Boundary Edges", "Export only the edges that border a single face"),
+            ("SHARP", "Sharp Edges", "Export only the edges marked as sharp"),
+        ),
+        default="ALL",
+    )
     triangulate_mesh: BoolProperty(
         name="Triangulate Mesh",
         description="Convert the mesh to triangles in the export",
         default=False,
     )
+    type_region: EnumProperty(
+        name="Region",
+        description="Only export the faces whose midpoints are inside a region of the scene",
+        items=(
+            ("ALL", "Everything", "Export the whole mesh"),
+            ("BOX", "Box", "Only export the faces inside a world-space box"),
+            ("EMPTY", "Object", "Only export the faces inside the bounds of an empty, or the bounding box of any other object"),
+            ("CAMERA", "Camera", "Only export the faces that the scene camera can see"),
+        ),
+        default="ALL",
+    )
+    region_min: FloatVectorProperty(
+        name="Region Min",
+        description="The lowest corner of the region box",
+        subtype="XYZ",
+        default=(-1.0, -1.0, -1.0),
+    )
+    region_max: FloatVectorProperty(
+        name="Region Max",
+        description="The highest corner of the region box",
+        subtype="XYZ",
+        default=(1.0, 1.0, 1.0),
+    )
+    region_empty: StringProperty(
+        name="Region Empty",
+        description="The empty (or other object) whose bounds make up the region",
+        default="",
+    )
     use_geo_x: BoolProperty(
         name="X Geometry",
         description="Export X geometry",
@@ -228,6 +326,37 @@ class ExportDESMOS(bpy.types.Operator, ExportHelper):
         default=False,
     )
     
+    # Baking
+    use_bake: BoolProperty(
+        name="Bake World Space",
+        description="Precompute the world-space transform of each frame, so Desmos only has to multiply and add",
+        default=False,
+    )
+    type_bake: EnumProperty(
+        name="Bake Output",
+        description="Choose how the baked world-space transforms are exported",
+        items=(
+            ("MATRIX", "Matrix Coefficients", "Export the world matrix of each frame as 12 columns (x' = m11*x + m12*y + m13*z + m14)"),
+            ("VERTICES", "Vertices per Frame", "Export the transformed vertices of each frame (WARNING: Results will become very large)"),
+        ),
+        default="MATRIX",
+    )
+    
+    # Deformation
+    use_deform: BoolProperty(
+        name="Deform Animation",
+        description="Export the vertices that move in each frame (shape keys, armatures) as offsets from the exported vertices",
+        default=False,
+    )
+    deform_tolerance: FloatProperty(
+        name="Deform Tolerance",
+        description="Vertices that moved less than this distance are left out of a frame",
+        min=0.0,
+        soft_max=1.0,
+        precision=5,
+        default=0.0001,
+    )
+    
     @classmethod
     def poll(cls, context):
         sfile = context.space_data
@@ -248,6 +377,17 @@ class ExportDESMOS(bpy.types.Operator, ExportHelper):
         format_box.prop(operator, "use_names")
         format_box.prop(operator, "use_full_precision", text="Use Full-Precision")
         
+        # Shard Settings
+        shard_box = layout.box()
+        shard_box.label(text="Shards", icon="FILE_FOLDER")
+        shard_box.prop(operator, "use_shards", text="Split Into Shards")
+        if operator.use_shards:
+            shard_box.prop(operator, "type_shards", text="Split By")
+            if operator.type_shards == "SIZE":
+                shard_box.prop(operator, "shard_size", text="Size (MB)")
+            else:
+                shard_box.prop(operator, "use_shard_update", text="Keep Other Shards")
+        
         # Geometry Settings
         geo_box = layout.box()
         geo_box.label(text="Geometry", icon="EXPORT")
@@ -266,6 +406,13 @@ class ExportDESMOS(bpy.types.Operator, ExportHelper):
         else:
             operator.attach_normals = False
         if_faces.prop(operator, "use_materials", text="Materials")
+        if_faces.prop(operator, "use_colors", text="Colors")
+        if operator.use_colors:
+            if_faces.prop(operator, "type_color_source", text="Source")
+            if_faces.prop(operator, "color_palette_size", text="Palette Size")
+        if_vertices.prop(operator, "use_edges", text="Edges")
+        if operator.use_edges:
+            if_vertices.prop(operator, "type_edges", text="Filter")
         
         row = if_vertices.row(heading="Include")
         row.prop(operator, "use_geo_x", text="X")
@@ -276,6 +423,14 @@ class ExportDESMOS(bpy.types.Operator, ExportHelper):
         if_faces.enabled = operator.use_faces
         if_faces.prop(operator, "triangulate_mesh", text="Triangulate Mesh", toggle=True)
         
+        region = if_vertices.column(align=True)
+        region.prop(operator, "type_region", text="Region")
+        if operator.type_region == "BOX":
+            region.prop(operator, "region_min", text="Min")
+            region.prop(operator, "region_max", text="Max")
+        elif operator.type_region == "EMPTY":
+            region.prop_search(operator, "region_empty", context.scene, "objects", text="Object")
+        
         # Animation Settings
         anim_box = layout.box()
         anim_box.label(text="Animation", icon="ANIM_DATA")
@@ -325,6 +480,17 @@ class ExportDESMOS(bpy.types.Operator, ExportHelper):
             if operator.use_rotation_global:
                 if_rot.prop(operator, "type_rotation_euler", text="Euler")
         
+            bake = anim_box.column(align=True)
+            bake.prop(operator, "use_bake", text="Bake World Space")
+            if operator.use_bake:
+                bake.prop(operator, "type_bake", text="Output")
+            
+            deform = anim_box.column(align=True)
+            deform.enabled = operator.use_vertices
+            deform.prop(operator, "use_deform", text="Deform Animation")
+            if operator.use_deform:
+                deform.prop(operator, "deform_tolerance", text="Tolerance")
+        
             anim_box.label(text="(Blender uses Z-Up. No other options here.)")
         pass
     
@@ -334,36 +500,522 @@ class ExportDESMOS(bpy.types.Operator, ExportHelper):
         
         export = export_desmos(self, context)
         
-        file_contents = export[0]
+        final = export[0]
         output_code = export[1]
         
-        if output_code == 1:
+        if output_code & 1:
             self.report({"WARNING"}, "Detected a face with more than 4 vertices. You might want to enable \"Triangulate Mesh\" in the future.")
+        if output_code & 2:
+            self.report({"WARNING"}, "Skipped deform frames where modifiers changed the vertex count. Apply or disable those modifiers to export them.")
+        if output_code & 4:
+            self.report({"WARNING"}, "Skipped colors for objects without a color attribute or UV map.")
+        if output_code & 8:
+            self.report({"WARNING"}, "Couldn't find the region's empty or the scene camera, so the whole mesh was exported.")
         
-        if self.type_output == "JSON":
-            filename = os.path.basename(filepath)
-            current_timestamp = time.time()
-            current_time_string = time.ctime(current_timestamp).replace("  ", " ")
-            file_contents = file_contents.replace('"title": "Blender Import"', f'"title": "`{filename}`\\n({current_time_string})"')
+        if self.use_shards:
+            write_shards(self, final, filepath)
+        else:
+            write_desmos(self, final, filepath)
         
-        fh = open(filepath, "w")
-        fh.write(file_contents)
+        return {'FINISHED'}
+
+
+
+
+# `write_desmos` compiles the objects of `final` and writes them to `filepath`, together with the manifest of a patch
+def write_desmos(op, final, filepath, object_count=1, object_total=None, is_shard=False, folder_scope=None):
+    # patches are compared against the manifest that the previous export to this file left behind
+    manifest_path = filepath + ".manifest.json"
+    previous_manifest = None
+    if op.type_output == "PATCH" and os.path.exists(manifest_path):
+        fh = open(manifest_path, "r")
+        previous_manifest = json.load(fh)
+        fh.close()
+    
+    # ids are scoped by the file name, so patches from different files (or shards) never touch each other's tables
+    id_scope = os.path.basename(filepath)
+    if folder_scope is None:
+        folder_scope = id_scope
+    
+    compiled = compile_desmos(op, final, object_count, object_total, previous_manifest, is_shard, id_scope, folder_scope)
+    
+    file_contents = compiled[0]
+    manifest = compiled[1]
+    
+    if op.type_output == "JSON":
+        file_contents = stamp_title(file_contents, filepath)
+    
+    fh = open(filepath, "w")
+    fh.write(file_contents)
+    fh.close()
+    
+    if manifest is not None:
+        fh = open(manifest_path, "w")
+        json.dump(manifest, fh)
+        fh.close()
+
+
+# `stamp_title` names the JSON folder after the file and the time of the export
+def stamp_title(file_contents, filepath):
+    filename = os.path.basename(filepath)
+    current_timestamp = time.time()
+    current_time_string = time.ctime(current_timestamp).replace("  ", " ")
+    return file_contents.replace('"title": "Blender Import"', f'"title": "`{filename}`\\n({current_time_string})"')
+
+
+# `estimate_size` roughly guesses how many characters the columns of an object will take up, before compiling them
+def estimate_size(exported_object, number_size):
+    return exported_object.count_values() * number_size
+
+
+# `export_settings` copies the operator's settings into a plain namespace, which can be read away from the main thread
+def export_settings(op):
+    settings = {}
+    for key in type(op).__annotations__:
+        value = getattr(op, key)
+        if not isinstance(value, (bool, int, float, str)):
+            value = tuple(value)
+        settings[key] = value
+    return SimpleNamespace(**settings)
+
+
+# `write_shards` writes the objects of `final` into separate files, and an index file at `filepath` listing all of them
+def write_shards(op, final, filepath):
+    root, extension = os.path.splitext(filepath)
+    names = list(final)
+    
+    # each shard is [path, names]. objects keep their number from the whole export, so shards never collide
+    shards = []
+    if op.type_shards == "OBJECT":
+        shard_paths = set()
+        for name in names:
+            # names that had to be cleaned up get a short hash of the real name, so "Cube.001" and "Cube_001" stay apart
+            safe_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in name)
+            if safe_name != name:
+                safe_name += "-" + hashlib.sha1(name.encode("utf-8")).hexdigest()[:6]
+            shard_path = f"{root}.{safe_name}{extension}"
+            if shard_path in shard_paths:
+                shard_path = f"{root}.{safe_name}-{names.index(name)+1}{extension}"
+            shard_paths.add(shard_path)
+            shards.append([shard_path, [name]])
+    else:
+        number_size = 24 if op.use_full_precision else 12
+        size_limit = op.shard_size * 1024 * 1024
+        group = []
+        group_size = 0
+        for name in names:
+            size = estimate_size(final[name], number_size)
+            if group and group_size + size > size_limit:
+                shards.append([f"{root}.part{len(shards)+1:03d}{extension}", group])
+                group = []
+                group_size = 0
+            group.append(name)
+            group_size += size
+        if group:
+            shards.append([f"{root}.part{len(shards)+1:03d}{extension}", group])
+    
+    # compiling and writing happen on a thread pool. bpy isn't thread-safe, so the workers only get a plain copy of the settings
+    settings = export_settings(op)
+    
+    def write_shard(shard):
+        shard_final = {name: final[name] for name in shard[1]}
+        write_desmos(settings, shard_final, shard[0], names.index(shard[1][0]) + 1, len(names), True, os.path.basename(filepath))
+    
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(write_shard, shards))
+    
+    # the index lists the shards of this export. when only some objects are being updated, the object shards
+    # from earlier exports to this path are kept too, so re-exporting a single object doesn't drop the others
+    shard_names = [os.path.basename(shard[0]) for shard in shards]
+    index_manifest_path = filepath + ".shards.json"
+    if op.type_shards == "OBJECT" and op.use_shard_update and os.path.exists(index_manifest_path):
+        fh = open(index_manifest_path, "r")
+        previous_index = json.load(fh)
         fh.close()
+        if previous_index["type_output"] == op.type_output and previous_index["type_shards"] == "OBJECT":
+            directory = os.path.dirname(filepath)
+            for shard_name in previous_index["shards"]:
+                if shard_name not in shard_names and os.path.exists(os.path.join(directory, shard_name)):
+                    shard_names.append(shard_name)
+    
+    fh = open(index_manifest_path, "w")
+    json.dump({"type_output": op.type_output, "type_shards": op.type_shards, "shards": shard_names}, fh)
+    fh.close()
+    
+    shard_list = "\n".join(sorted(shard_names))
+    
+    if op.type_output == "JSON":
+        folder = {"type": "folder", "title": "Blender Import", "id": "#folderId", "hidden": True, "collapsed": True}
+        dump = json.dumps(folder).replace('"id": "#folderId"', '"id": folderId')
+        index = f"""// ----------------- DISCLAIMER -------------------
+// WARNING: It is EXTREMELY unsafe to inject unverified code like this into your browser. Please read the code CAREFULLY before you are ready to proceed with the injection.
+// P.S. This will modify any unsaved graph in progress! You cannot undo this operation.
+
+
+/* INSTRUCTIONS
+This export was split into shards. Paste this index first, it creates the folder that the shards go into.
+Afterwards, paste any of these shards into the same console, one at a time:
+
+{shard_list}
+*/
+
+folderId = Calc.controller.generateId();
+state = Calc.getState();
+state.expressions.list.push({dump});
+Calc.setState(state);"""
+        index = stamp_title(index, filepath)
+    else:
+        index = f"""/* This export was split into shards. Paste these files into Desmos one at a time:
+
+{shard_list}
+*/
+"""
+    
+    fh = open(filepath, "w")
+    fh.write(index)
+    fh.close()
+
+
+# `Columns` holds a group of equally long Desmos columns as the rows of a single typed array.
+# Looking up a column by its label returns a view of its row, so nothing is copied or boxed until it gets written.
+class Columns:
+    __slots__ = ("labels", "values")
+    
+    def __init__(self, labels, values):
+        self.labels = labels
+        self.values = values
+    
+    def __iter__(self):
+        return iter(self.labels)
+    
+    def __getitem__(self, label):
+        return self.values[self.labels.index(label)]
+
+
+# `ExportedObject` is everything collected for one object. Unused channels stay None.
+# `material` and `color` are plain typed arrays. `bake` and `deform` map each frame to its `Columns`, and `deform_index` maps
+# each frame to a typed array of the vertices that moved.
+class ExportedObject:
+    __slots__ = (
+        "vert", "face", "edge", "midpoint", "normal", "material", "color", "palette",
+        "loc", "rot", "scale", "matrix", "bake", "deform", "deform_index",
+    )
+    
+    def __init__(self):
+        for slot in self.__slots__:
+            setattr(self, slot, None)
+    
+    # `count_values` counts every number stored in the object, so shards can be sized before they are compiled
+    def count_values(self):
+        count = 0
+        for slot in self.__slots__:
+            channel = getattr(self, slot)
+            if isinstance(channel, dict):
+                channel = list(channel.values())
+            else:
+                channel = [channel]
+            for values in channel:
+                if isinstance(values, Columns):
+                    count += values.values.size
+                elif values is not None:
+                    count += values.size
+        return count
+
+
+# `axis_columns` turns a (3, n) array into x/y/z columns, leaving out the axes that aren't exported
+def axis_columns(op, values):
+    labels = []
+    rows = []
+    for row, (axis, enabled) in enumerate((("x", op.use_geo_x), ("y", op.use_geo_y), ("z", op.use_geo_z))):
+        if enabled:
+            labels.append(axis)
+            rows.append(row)
+    if len(labels) == 0:
+        return None
+    
+    # with every axis enabled the rows can be used as they are, without a copy
+    if len(rows) < 3:
+        values = values[rows]
+    return Columns(labels, values)
+
+
+# `mesh_coordinates` reads every vertex position of a mesh in bulk, as a (vertices, 3) array
+def mesh_coordinates(mesh):
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", co)
+    return co.reshape(-1, 3)
+
+
+# `to_world` moves a (points, 3) array from the local space of an object into world space
+def to_world(points, matrix):
+    return points @ matrix[:3, :3].T + matrix[:3, 3]
+
+
+# `region_corners` returns the 8 world-space corners of the export region (the near face, then the far face), or None
+def region_corners(op, context):
+    cube = np.array([[-1, -1, -1], [1, -1, -1], [1, 1, -1], [-1, 1, -1], [-1, -1, 1], [1, -1, 1], [1, 1, 1], [-1, 1, 1]], dtype=np.float64)
+    
+    if op.type_region == "BOX":
+        lower = np.minimum(op.region_min, op.region_max)
+        upper = np.maximum(op.region_min, op.region_max)
+        return lower + (cube + 1) / 2 * (upper - lower)
+    
+    if op.type_region == "EMPTY":
+        region_object = context.scene.objects.get(op.region_empty)
+        if region_object is None:
+            return None
         
-        return {'FINISHED'}
+        # empties have no geometry, so their display size is their bounds. anything else uses its bounding box
+        if region_object.type == "EMPTY":
+            corners = cube * region_object.empty_display_size
+        else:
+            bound_box = np.array([corner[:] for corner in region_object.bound_box], dtype=np.float64)
+            lower = bound_box.min(axis=0)
+            upper = bound_box.max(axis=0)
+            corners = lower + (cube + 1) / 2 * (upper - lower)
+        return to_world(corners, np.array(region_object.matrix_world, dtype=np.float64))
+    
+    if op.type_region == "CAMERA":
+        camera = context.scene.camera
+        if camera is None:
+            return None
+        frame = np.array([corner[:] for corner in camera.data.view_frame(scene=context.scene)], dtype=np.float64)
+        
+        # the view frame sits at some depth in front of the camera. push it out to the clipping distances
+        corners = []
+        for clip in (camera.data.clip_start, camera.data.clip_end):
+            if camera.data.type == "ORTHO":
+                corners.append(np.column_stack([frame[:, 0], frame[:, 1], np.full(4, -clip)]))
+            else:
+                corners.append(frame * (clip / -frame[:, 2:3]))
+        return to_world(np.concatenate(corners), np.array(camera.matrix_world, dtype=np.float64))
+    
+    return None
+
 
+# `inside_region` tells which points are inside the region made up by `corners`
+def inside_region(points, corners):
+    # a cheap bounding box test rules out most points, so the exact plane tests only run on the rest
+    candidates = np.flatnonzero(np.all((points >= corners.min(axis=0)) & (points <= corners.max(axis=0)), axis=1))
+    
+    center = corners.mean(axis=0)
+    for a, b, c in ((0, 1, 2), (4, 5, 6), (0, 1, 5), (1, 2, 6), (2, 3, 7), (3, 0, 4)):
+        normal = np.cross(corners[b] - corners[a], corners[c] - corners[a])
+        offset = normal @ corners[a]
+        
+        # the planes face outwards, so the center of the region is always behind them
+        if normal @ center > offset:
+            normal = -normal
+            offset = -offset
+        
+        candidates = candidates[points[candidates] @ normal <= offset + 1e-9]
+    
+    is_inside = np.zeros(len(points), dtype=bool)
+    is_inside[candidates] = True
+    return is_inside
 
 
+# `face_loops` returns where each face starts in the loops of a mesh, and how many loops it has
+def face_loops(mesh):
+    loop_starts = np.empty(len(mesh.polygons), dtype=np.int32)
+    loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("loop_start", loop_starts)
+    mesh.polygons.foreach_get("loop_total", loop_totals)
+    return loop_starts, loop_totals
+
+
+# `average_per_face` averages a per-loop array over the loops of each face
+def average_per_face(mesh, loop_values):
+    loop_starts, loop_totals = face_loops(mesh)
+    if len(loop_starts) == 0:
+        return np.zeros((0, loop_values.shape[1]))
+    return np.add.reduceat(loop_values, loop_starts, axis=0) / loop_totals[:, np.newaxis]
+
+
+# `linear_to_srgb` converts blender's linear colors into the sRGB colors that desmos displays
+def linear_to_srgb(colors):
+    colors = np.clip(colors, 0.0, 1.0)
+    return np.where(colors <= 0.0031308, colors * 12.92, 1.055 * np.power(colors, 1 / 2.4) - 0.055)
+
+
+# `face_colors_from_attribute` averages the active color attribute over each face, or returns None without one
+def face_colors_from_attribute(mesh):
+    attribute = mesh.color_attributes.active_color
+    if attribute is None:
+        return None
+    
+    colors = np.empty(len(attribute.data) * 4, dtype=np.float32)
+    attribute.data.foreach_get("color", colors)
+    colors = linear_to_srgb(colors.reshape(-1, 4)[:, :3])
+    
+    # vertex colors are spread out to the loops first, so both domains average the same way
+    if attribute.domain == "POINT":
+        loop_vertices = np.empty(len(mesh.loops), dtype=np.int32)
+        mesh.loops.foreach_get("vertex_index", loop_vertices)
+        colors = colors[loop_vertices]
+    return average_per_face(mesh, colors)
+
+
+# `material_image` finds the first image texture of a material, if there is one
+def material_image(material):
+    if material is None or not material.use_nodes:
+        return None
+    nodes = material.node_tree.nodes
+    
+    # follow the surface shader's color input, so normal, roughness or AO maps aren't mistaken for the color
+    for output in nodes:
+        if output.type != "OUTPUT_MATERIAL" or not output.is_active_output:
+            continue
+        surface = output.inputs.get("Surface")
+        if surface is None or not surface.is_linked:
+            continue
+        shader = surface.links[0].from_node
+        color = shader.inputs.get("Base Color") or shader.inputs.get("Color")
+        if color is not None and color.is_linked:
+            image = linked_image(color)
+            if image is not None:
+                return image
+    
+    # without such a link, the first image texture is the best guess
+    for node in nodes:
+        if node.type == "TEX_IMAGE" and node.image is not None:
+            return node.image
+    return None
+
+
+# `linked_image` searches upstream of a node socket (through mix, hue and other color nodes) for an image texture
+def linked_image(socket):
+    pending = [link.from_node for link in socket.links]
+    visited = set()
+    while pending:
+        node = pending.pop(0)
+        if node.name in visited:
+            continue
+        visited.add(node.name)
+        if node.type == "TEX_IMAGE" and node.image is not None:
+            return node.image
+        for node_input in node.inputs:
+            pending.extend(link.from_node for link in node_input.links)
+    return None
+
+
+# `sample_image` reads the sRGB color of an image's pixels at an array of UVs, wrapping around like a repeating texture
+def sample_image(pixels, uvs, is_float):
+    height, width = pixels.shape[:2]
+    x = np.clip((np.mod(uvs[:, 0], 1.0) * width).astype(np.int32), 0, width - 1)
+    y = np.clip((np.mod(uvs[:, 1], 1.0) * height).astype(np.int32), 0, height - 1)
+    sampled = pixels[y, x, :3]
+    
+    # byte images are already stored as sRGB, float images are linear
+    if is_float:
+        sampled = linear_to_srgb(sampled)
+    return sampled
+
+
+# `face_colors_from_texture` samples each material's image at the corners and the UV center of every face, and averages them
+def face_colors_from_texture(mesh, materials):
+    uv_layer = mesh.uv_layers.active
+    if uv_layer is None:
+        return None
+    
+    uvs = np.empty(len(mesh.loops) * 2, dtype=np.float32)
+    uv_layer.data.foreach_get("uv", uvs)
+    uvs = uvs.reshape(-1, 2)
+    
+    # corners often land on seams or padding of an unwrapped atlas, the center of the face is sampled too
+    face_uvs = average_per_face(mesh, uvs)
+    
+    loop_totals = face_loops(mesh)[1]
+    material_indices = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("material_index", material_indices)
+    loop_materials = np.repeat(material_indices, loop_totals)
+    
+    # faces without a texture fall back to their material's viewport color, or plain grey
+    loop_colors = np.full((len(mesh.loops), 3), 0.8)
+    center_colors = np.full((len(mesh.polygons), 3), 0.8)
+    for material_index, material in enumerate(materials):
+        is_loop_material = loop_materials == material_index
+        is_face_material = material_indices == material_index
+        image = material_image(material)
+        width, height = (0, 0) if image is None else image.size
+        
+        if width * height == 0:
+            if material is not None:
+                color = linear_to_srgb(np.array(material.diffuse_color[:3]))
+                loop_colors[is_loop_material] = color
+                center_colors[is_face_material] = color
+            continue
+        
+        pixels = np.empty(len(image.pixels), dtype=np.float32)
+        image.pixels.foreach_get(pixels)
+        pixels = pixels.reshape(height, width, image.channels)
+        
+        loop_colors[is_loop_material] = sample_image(pixels, uvs[is_loop_material], image.is_float)
+        center_colors[is_face_material] = sample_image(pixels, face_uvs[is_face_material], image.is_float)
+    
+    # the center counts as one more sample next to the corners
+    corner_colors = average_per_face(mesh, loop_colors)
+    return (corner_colors * loop_totals[:, np.newaxis] + center_colors) / (loop_totals[:, np.newaxis] + 1)
+
+
+# `quantize_colors` reduces the face colors to a palette with median cut, returning the palette and an index per face
+def quantize_colors(colors, palette_size):
+    # desmos' rgb() can't display anything finer than 8 bits, and rounding first lets identical colors collapse
+    colors = np.clip(np.round(colors * 255), 0, 255).astype(np.int32)
+    unique, inverse, counts = np.unique(colors, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    
+    # keep splitting the box with the widest channel at its median, weighted by the number of faces
+    boxes = [np.arange(len(unique))]
+    spreads = [np.ptp(unique, axis=0) if len(unique) > 0 else np.zeros(3, dtype=np.int32)]
+    while len(boxes) < palette_size:
+        widest = int(np.argmax([spread.max() for spread in spreads]))
+        if spreads[widest].max() == 0:
+            break
+        
+        box = boxes[widest]
+        channel = int(np.argmax(spreads[widest]))
+        box = box[np.argsort(unique[box, channel], kind="stable")]
+        cumulative = np.cumsum(counts[box])
+        split = int(np.searchsorted(cumulative, cumulative[-1] / 2)) + 1
+        split = min(max(split, 1), len(box) - 1)
+        
+        boxes[widest] = box[:split]
+        spreads[widest] = np.ptp(unique[box[:split]], axis=0)
+        boxes.append(box[split:])
+        spreads.append(np.ptp(unique[box[split:]], axis=0))
+    
+    palette = np.zeros((len(boxes), 3), dtype=np.int32)
+    unique_to_palette = np.zeros(len(unique), dtype=np.int32)
+    for palette_index, box in enumerate(boxes):
+        if len(box) == 0:
+            continue
+        palette[palette_index] = np.round(np.average(unique[box], axis=0, weights=counts[box]))
+        unique_to_palette[box] = palette_index
+    return palette, unique_to_palette[inverse]
+
+
+# `stable_id` gives an expression the same id in every export, so that a patch can find it again in the graph
+def stable_id(key):
+    return "b2d" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+# `expression_hash` fingerprints an expression, so a patch can tell whether it changed
+def expression_hash(expression):
+    return hashlib.sha1(json.dumps(expression, sort_keys=True).encode("utf-8")).hexdigest()
+
 
 def export_desmos(op, context):
-    # This is the final dictionary. As I add objects, I will push the information to this.
+    # This is the final dictionary. As I add objects, I will push an `ExportedObject` to this.
     final = {}
     is_face_too_large = False
-    object_count = 1
+    is_deform_mismatch = False
+    is_color_missing = False
+    is_region_missing = False
     
     
     for selected_object in context.selected_objects:
-        final[selected_object.name] = {}
+        final[selected_object.name] = ExportedObject()
         obj = final[selected_object.name]
         
         # Geometry Export
@@ -398,116 +1050,125 @@ def export_desmos(op, context):
 
         # if vertices are enabled, we are good to export the geometry
         if op.use_vertices:
-            if op.use_geo_x or op.use_geo_y or op.use_geo_z:
-                obj["vert"] = {}
-                vert = obj["vert"]
-            if op.use_geo_x:
-                vert["x"] = []
-            if op.use_geo_y:
-                vert["y"] = []
-            if op.use_geo_z:
-                vert["z"] = []
-            for vert_element in data.vertices.values():
-                if op.use_geo_x:
-                    vert["x"].append(vert_element.co.x)
-                if op.use_geo_y:
-                    vert["y"].append(vert_element.co.y)
-                if op.use_geo_z:
-                    vert["z"].append(vert_element.co.z)
+            # everything is read in bulk first, so the region below can filter it before anything is exported
+            co = mesh_coordinates(data)
+            loop_starts, loop_totals = face_loops(data)
+            loop_vertices = np.empty(len(data.loops), dtype=np.int32)
+            data.loops.foreach_get("vertex_index", loop_vertices)
+            centers = np.empty(len(data.polygons) * 3, dtype=np.float32)
+            data.polygons.foreach_get("center", centers)
+            centers = centers.reshape(-1, 3)
+            
+            # Region
+            # faces are kept by their midpoint, and vertices by the faces that use them. the kept vertices are then renumbered
+            face_mask = np.ones(len(data.polygons), dtype=bool)
+            vertex_mask = np.ones(len(co), dtype=bool)
+            if op.type_region != "ALL":
+                corners = region_corners(op, context)
+                if corners is None:
+                    is_region_missing = True
+                else:
+                    object_matrix = np.array(selected_object.matrix_world, dtype=np.float64)
+                    face_mask = inside_region(to_world(centers, object_matrix), corners)
+                    
+                    is_used = np.zeros(len(co), dtype=bool)
+                    is_used[loop_vertices] = True
+                    vertex_mask = np.zeros(len(co), dtype=bool)
+                    vertex_mask[loop_vertices[np.repeat(face_mask, loop_totals)]] = True
+                    
+                    # loose vertices don't belong to any face, so they are checked by their own position
+                    loose_vertices = np.flatnonzero(~is_used)
+                    if len(loose_vertices) > 0:
+                        vertex_mask[loose_vertices] = inside_region(to_world(co[loose_vertices], object_matrix), corners)
+            vertex_remap = np.cumsum(vertex_mask, dtype=np.int32)
+            
+            obj.vert = axis_columns(op, co[vertex_mask].T)
             
             # Faces
             if op.use_faces:
-                obj["face"] = {}
-                face = obj["face"]
+                face_starts = loop_starts[face_mask]
+                face_totals = loop_totals[face_mask]
+                face_count = len(face_totals)
 
                 # we can get the largest face dimension beforehand here
                 largest_dimension = 0
-                for polygon_element in data.polygons.values():
-                    if largest_dimension < len(polygon_element.vertices):
-                        largest_dimension = len(polygon_element.vertices)
+                if face_count > 0:
+                    largest_dimension = int(face_totals.max())
                 if largest_dimension > 4:
                     is_face_too_large = True
                 
-                for polygon_element in data.polygons.values():
-                    i = 0
-                    for vert_index in polygon_element.vertices:
-                        try:
-                            face[f"{i+1:0>2d}"].append(vert_index + 1)
-                        except:
-                            face[f"{i+1:0>2d}"] = []
-                            face[f"{i+1:0>2d}"].append(vert_index + 1)
-                        i += 1
-
-                    # This prevents it from parsing past largest_dimension
-                    while i < largest_dimension:
-                        try:
-                            face[f"{i+1:0>2d}"].append(math.inf)
-                        except:
-                            face[f"{i+1:0>2d}"] = []
-                            face[f"{i+1:0>2d}"].append(math.inf)
-                        i += 1
-                
-                face_count = 0
-                try:
-                    face_count = len(face["01"])
-                except:
-                    face_count = 0 
+                # every corner goes into the column of its position in the face. shorter faces are padded with 0, written as infinity
+                corner_positions = np.arange(face_totals.sum()) - np.repeat(np.cumsum(face_totals) - face_totals, face_totals)
+                corner_faces = np.repeat(np.arange(face_count), face_totals)
+                corner_loops = np.repeat(face_starts, face_totals) + corner_positions
+                columns = np.zeros((largest_dimension, face_count), dtype=np.int32)
+                columns[corner_positions, corner_faces] = vertex_remap[loop_vertices[corner_loops]]
+                obj.face = Columns([f"{i+1:0>2d}" for i in range(largest_dimension)], columns)
                 
                 # Midpoints
                 if op.use_midpoints:
-                    if op.use_geo_x or op.use_geo_y or op.use_geo_z:
-                        obj["midpoint"] = {}
-                        midpoint = obj["midpoint"]
-                    if op.use_geo_x:
-                        midpoint["x"] = []
-                    if op.use_geo_y:
-                        midpoint["y"] = []
-                    if op.use_geo_z:
-                        midpoint["z"] = []
-                    for polygon_element in data.polygons.values():
-                        if op.use_geo_x:
-                            midpoint["x"].append(polygon_element.center.x)
-                        if op.use_geo_y:
-                            midpoint["y"].append(polygon_element.center.y)
-                        if op.use_geo_z:
-                            midpoint["z"].append(polygon_element.center.z)
+                    obj.midpoint = axis_columns(op, centers[face_mask].T)
                 
                 # Normals
                 if op.use_normals:
-                    if op.use_geo_x or op.use_geo_y or op.use_geo_z:
-                        obj["normal"] = {}
-                        normal = obj["normal"]
-                    if op.use_geo_x:
-                        normal["x"] = []
-                    if op.use_geo_y:
-                        normal["y"] = []
-                    if op.use_geo_z:
-                        normal["z"] = []
-                    for polygon_element in data.polygons.values():
-                        if op.use_geo_x:
-                            normal["x"].append(polygon_element.normal.x)
-                        if op.use_geo_y:
-                            normal["y"].append(polygon_element.normal.y)
-                        if op.use_geo_z:
-                            normal["z"].append(polygon_element.normal.z)
+                    normals = np.empty(len(data.polygons) * 3, dtype=np.float32)
+                    data.polygons.foreach_get("normal", normals)
+                    normals = normals.reshape(-1, 3)[face_mask]
                     
                     # Attach Normals
+                    # blender's data is 32-bit, but anything computed from it here is kept at 64-bit so no precision is lost
                     if op.attach_normals:
-                        
-                        for i in range(face_count):
-                            if op.use_geo_x:
-                                normal["x"][i] = normal["x"][i] * 0.01 + midpoint["x"][i]
-                            if op.use_geo_y:
-                                normal["y"][i] = normal["y"][i] * 0.01 + midpoint["y"][i]
-                            if op.use_geo_z:
-                                normal["z"][i] = normal["z"][i] * 0.01 + midpoint["z"][i]
+                        normals = normals.astype(np.float64) * 0.01 + centers[face_mask]
+                    
+                    obj.normal = axis_columns(op, normals.T)
                             
                 # Materials
                 if op.use_materials:
-                    obj["material"] = []
-                    material = obj["material"]
-                    for polygon_element in data.polygons.values():
-                        material.append(polygon_element.material_index)
+                    material_indices = np.empty(len(data.polygons), dtype=np.int32)
+                    data.polygons.foreach_get("material_index", material_indices)
+                    obj.material = material_indices[face_mask]
+                
+                # Colors
+                if op.use_colors:
+                    if op.type_color_source == "ATTRIBUTE":
+                        colors = face_colors_from_attribute(data)
+                    else:
+                        colors = face_colors_from_texture(data, [slot.material for slot in selected_object.material_slots])
+                    
+                    if colors is None:
+                        is_color_missing = True
+                    else:
+                        palette, color_indices = quantize_colors(colors[face_mask], op.color_palette_size)
+                        obj.palette = Columns(["r", "g", "b"], palette.T)
+                        obj.color = (color_indices + 1).astype(np.int32)
+            
+            # Edges
+            if op.use_edges:
+                # read all of the edges in bulk. blender stores each edge once, so shared edges are never repeated
+                edge_vertices = np.empty(len(data.edges) * 2, dtype=np.int32)
+                data.edges.foreach_get("vertices", edge_vertices)
+                edge_vertices = edge_vertices.reshape(-1, 2)
+                
+                # count the faces of each edge, both in the whole mesh and among the faces kept by the region
+                loop_edges = np.empty(len(data.loops), dtype=np.int32)
+                data.loops.foreach_get("edge_index", loop_edges)
+                face_counts = np.bincount(loop_edges, minlength=len(data.edges))
+                kept_face_counts = np.bincount(loop_edges[np.repeat(face_mask, loop_totals)], minlength=len(data.edges))
+                
+                if op.type_edges == "BOUNDARY":
+                    # a boundary edge is only used by a single face. edges along the region's cut become boundaries too
+                    edge_mask = kept_face_counts == 1
+                else:
+                    # edges of kept faces, and loose edges (no faces at all) whose vertices are both kept
+                    is_loose = face_counts == 0
+                    edge_mask = (kept_face_counts >= 1) | (is_loose & vertex_mask[edge_vertices[:, 0]] & vertex_mask[edge_vertices[:, 1]])
+                
+                if op.type_edges == "SHARP":
+                    is_sharp = np.empty(len(data.edges), dtype=bool)
+                    data.edges.foreach_get("use_edge_sharp", is_sharp)
+                    edge_mask &= is_sharp
+                
+                obj.edge = Columns(["01", "02"], vertex_remap[edge_vertices[edge_mask].T])
                 
                 
                 
@@ -515,87 +1176,160 @@ def export_desmos(op, context):
         
         # Animation Export
         if op.use_animation:
-            if op.use_location_x or op.use_location_y or op.use_location_z:
-                obj["loc"] = {}
-                loc = obj["loc"]
-            if op.use_location_x:
-                loc["x"] = []
-            if op.use_location_y:
-                loc["y"] = []
-            if op.use_location_z:
-                loc["z"] = []
+            # every channel gets one row per axis, with a slot for each frame that will be sampled
+            frame_total = len(range(op.frame_start, op.frame_end + 1, op.frame_step))
             
-            if op.use_rotation_x or op.use_rotation_y or op.use_rotation_z:
-                obj["rot"] = {}
-                rot = obj["rot"]
-            if op.use_rotation_x:
-                rot["x"] = []
-            if op.use_rotation_y:
-                rot["y"] = []
-            if op.use_rotation_z:
-                rot["z"] = []
+            labels = [axis for axis, enabled in (("x", op.use_location_x), ("y", op.use_location_y), ("z", op.use_location_z)) if enabled]
+            if len(labels) > 0:
+                obj.loc = Columns(labels, np.empty((len(labels), frame_total), dtype=np.float64))
+                loc = obj.loc
             
-            if op.use_scale_x or op.use_scale_y or op.use_scale_z:
-                obj["scale"] = {}
-                scale = obj["scale"]
-            if op.use_scale_x:
-                scale["x"] = []
-            if op.use_scale_y:
-                scale["y"] = []
-            if op.use_scale_z:
-                scale["z"] = []
+            labels = [axis for axis, enabled in (("x", op.use_rotation_x), ("y", op.use_rotation_y), ("z", op.use_rotation_z)) if enabled]
+            if len(labels) > 0:
+                obj.rot = Columns(labels, np.empty((len(labels), frame_total), dtype=np.float64))
+                rot = obj.rot
             
+            labels = [axis for axis, enabled in (("x", op.use_scale_x), ("y", op.use_scale_y), ("z", op.use_scale_z)) if enabled]
+            if len(labels) > 0:
+                obj.scale = Columns(labels, np.empty((len(labels), frame_total), dtype=np.float64))
+                scale = obj.scale
+            
+            
+            # every sampled world matrix is kept whole (all 16 floats), so baking never has to rebuild it
+            frame_matrices = np.empty((frame_total, 4, 4), dtype=np.float64)
+            
+            # deforming objects are compared against the exported vertices, so only moved vertices are kept
+            if op.use_deform and op.use_vertices:
+                obj.deform = {}
+                obj.deform_index = {}
+                deform_base = co
             
             frame_initial = context.scene.frame_current
             frame_current = op.frame_start
+            frame_index = 0
             while frame_current <= op.frame_end:
                 context.scene.frame_set(frame_current)
                 context.view_layer.update()
                 
+                matrix_world = selected_object.matrix_world.copy()
+                frame_matrices[frame_index] = matrix_world
+                
+                if obj.deform is not None:
+                    evaluated_object = selected_object.evaluated_get(context.evaluated_depsgraph_get())
+                    evaluated_mesh = evaluated_object.to_mesh()
+                    
+                    # modifiers that add or remove vertices can't be lined up with the exported vertices
+                    if len(evaluated_mesh.vertices) == len(deform_base):
+                        offset = (mesh_coordinates(evaluated_mesh) - deform_base)[vertex_mask]
+                        moved = np.flatnonzero((offset * offset).sum(axis=1) > op.deform_tolerance ** 2)
+                        
+                        obj.deform_index[frame_index + 1] = (moved + 1).astype(np.int32)
+                        obj.deform[frame_index + 1] = axis_columns(op, offset[moved].T)
+                    else:
+                        is_deform_mismatch = True
+                    
+                    evaluated_object.to_mesh_clear()
+                
                 if op.use_location_global:
-                    target = selected_object.matrix_world.to_translation()
+                    target = matrix_world.to_translation()
                 else:
                     target = selected_object.location
                 if op.use_location_x:
-                    loc["x"].append(target.x)
+                    loc["x"][frame_index] = target.x
                 if op.use_location_y:
-                    loc["y"].append(target.y)
+                    loc["y"][frame_index] = target.y
                 if op.use_location_z:
-                    loc["z"].append(target.z)
+                    loc["z"][frame_index] = target.z
                 
                 convert_unit = 1.0
                 if op.type_rotation_units == "DEG":
                     convert_unit = 180 / math.pi
                     
                 if op.use_rotation_global:
-                    target = selected_object.matrix_world.to_euler(op.type_rotation_euler)
+                    target = matrix_world.to_euler(op.type_rotation_euler)
                 else:
                     target = selected_object.rotation_euler
                 if op.use_rotation_x:
-                    rot["x"].append(target.x * convert_unit)
+                    rot["x"][frame_index] = target.x * convert_unit
                 if op.use_rotation_y:
-                    rot["y"].append(target.y * convert_unit)
+                    rot["y"][frame_index] = target.y * convert_unit
                 if op.use_rotation_z:
-                    rot["z"].append(target.z * convert_unit)
+                    rot["z"][frame_index] = target.z * convert_unit
                 
                 if op.use_scale_global:
-                    target = selected_object.matrix_world.to_scale()
+                    target = matrix_world.to_scale()
                 else:
                     target = selected_object.scale
                 if op.use_scale_x:
-                    scale["x"].append(target.x)
+                    scale["x"][frame_index] = target.x
                 if op.use_scale_y:
-                    scale["y"].append(target.y)
+                    scale["y"][frame_index] = target.y
                 if op.use_scale_z:
-                    scale["z"].append(target.z)
+                    scale["z"][frame_index] = target.z
                 
                     
                 
                 frame_current += op.frame_step
+                frame_index += 1
             context.scene.frame_set(frame_initial)
+            
+            # Baking
+            if op.use_bake and frame_total > 0:
+                if op.type_bake == "MATRIX":
+                    # the top 3 rows of each matrix. desmos rebuilds a vertex with x' = m11*x + m12*y + m13*z + m14
+                    labels = [f"{row+1}{column+1}" for row in range(3) for column in range(4)]
+                    obj.matrix = Columns(labels, frame_matrices[:, :3, :].reshape(frame_total, 12).T)
+                
+                elif op.type_bake == "VERTICES" and obj.vert is not None:
+                    # transform the vertices of every frame at once with a single batched multiply, into (frames, axes, vertices)
+                    baked = np.einsum("fij,vj->fiv", frame_matrices[:, :3, :3], co[vertex_mask]) + frame_matrices[:, :3, 3, np.newaxis]
+                    
+                    obj.bake = {}
+                    for frame_index in range(frame_total):
+                        obj.bake[frame_index + 1] = axis_columns(op, baked[frame_index])
         # animation ends here
     
-    # The export is now concluded. Here are the functions used to compile the results above.
+    output_code = 0
+    if is_face_too_large:
+        output_code += 1
+    if is_deform_mismatch:
+        output_code += 2
+    if is_color_missing:
+        output_code += 4
+    if is_region_missing:
+        output_code += 8
+    
+    return [final, output_code]
+
+
+
+# `dump_expression` writes one expression as JSON. the columns of a table were already written as they were emitted
+def dump_expression(expression):
+    if expression["type"] != "table":
+        return json.dumps(expression)
+    table = {key: value for key, value in expression.items() if key != "columns"}
+    columns = ", ".join(column["json"] for column in expression["columns"])
+    return json.dumps(table)[:-1] + f', "columns": [{columns}]}}'
+
+
+# `dump_expressions` writes a list of expressions as a JSON array
+def dump_expressions(expressions):
+    return "[" + ", ".join(dump_expression(expression) for expression in expressions) + "]"
+
+
+# `dump_patch` writes a patch as JSON, the same way `dump_expressions` does
+def dump_patch(patch):
+    upserts = []
+    for update in patch["upsert"]:
+        upserts.append(f'{{"expression": {dump_expression(update["expression"])}, "removeColumns": {json.dumps(update["removeColumns"])}}}')
+    return f'{{"upsert": [{", ".join(upserts)}], "remove": {json.dumps(patch["remove"])}}}'
+
+
+# The export is now concluded. Here are the functions used to compile the results above.
+def compile_desmos(op, final, object_count=1, object_total=None, previous_manifest=None, is_shard=False, id_scope="", folder_scope=""):
+    # shards only hold some of the objects, but they are named as part of the whole export
+    if object_total is None:
+        object_total = len(final)
     
     # `console` is the final output that will be written to the file
     console = ""
@@ -603,16 +1337,28 @@ def export_desmos(op, context):
     # `final_json` is the final dict that will be converted into `console`, if JSON mode is enabled
     final_json = [{"type": "folder", "title": "Blender Import", "id": "#folderId", "hidden": True, "collapsed": True}]
     
+    # patches can't generate their ids in the browser, they need to be the same in every export
+    if op.type_output == "PATCH":
+        final_json[0]["id"] = stable_id(f"{folder_scope}/folder")
+    
+    # `manifest` remembers every id and hash of this export, so the next patch knows what to leave alone
+    manifest = None
+    
     # `file_push` creates either a newline in the text file, or a new column in the Desmos table
     def file_push(var_name, value_list):
         nonlocal console, final_json
+        # columns are stored as typed arrays. only the one being written is turned into python numbers
+        value_list = value_list.tolist()
         if op.type_output == "TXT":
             console += f"{var_name}={str_list(value_list)}\n"
-        elif op.type_output == "JSON":
-            current_column = {"latex": var_name, "values": [], "hidden": True, "id": "#Calc.controller.generateId()"}
+        elif op.type_output == "JSON" or op.type_output == "PATCH":
+            if op.type_output == "JSON":
+                current_column = {"latex": var_name, "values": [], "hidden": True, "id": "#Calc.controller.generateId()"}
+            else:
+                current_column = {"latex": var_name, "values": [], "hidden": True, "id": stable_id(f"{id_scope}/{name}/{var_name}")}
             current_column["values"] = json_list(value_list)
-            final_json[-1]["columns"].append(current_column)
-            pass
+            # the column is turned into JSON text right away, so only one column of value strings exists at a time
+            final_json[-1]["columns"].append({"id": current_column["id"], "json": json.dumps(current_column)})
         return
     
     # `simplify_num` takes a number, and rounds it, removing any unnecessary precision
@@ -639,7 +1385,7 @@ def export_desmos(op, context):
         
         # final polish, cause sometimes there was a ".0" left behind.
         if float(stringified) == round(float(stringified)):
-            stringied = str(round(float(stringied)))
+            stringified = str(round(float(stringified)))
         return stringified
     
     # `str_list` returns a plain-text list version of a number list, using `simply_num` rules 
@@ -682,74 +1428,140 @@ def export_desmos(op, context):
         elif op.type_output == "JSON":
             final_json.append({"type": "text", "text": f'"{name}"', "folderId": "#folderId", "id": "#Calc.controller.generateId()"})
             final_json.append({"type": "table", "columns": [], "folderId": "#folderId", "id": "#Calc.controller.generateId()"})
+        elif op.type_output == "PATCH":
+            final_json.append({"type": "text", "text": f'"{name}"', "folderId": final_json[0]["id"], "id": stable_id(f"{id_scope}/{name}/text")})
+            final_json.append({"type": "table", "columns": [], "folderId": final_json[0]["id"], "id": stable_id(f"{id_scope}/{name}/table")})
         
         # push all of the data into the object, finally
         if op.use_vertices:
-            for axis in final[name]["vert"]:
-                var_name = ""
-                var_name += f"{axis}_"
-                if op.use_midpoints or op.use_normals:
-                    var_name += "{Vertices"
-                else:
-                    var_name += "{"
-                var_name += f"{prefix}" + "}"
-                file_push(var_name, final[name]["vert"][axis])
+            if final[name].vert is not None:
+                for axis in final[name].vert:
+                    var_name = ""
+                    var_name += f"{axis}_"
+                    if op.use_midpoints or op.use_normals:
+                        var_name += "{Vertices"
+                    else:
+                        var_name += "{"
+                    var_name += f"{prefix}" + "}"
+                    file_push(var_name, final[name].vert[axis])
             
-            if "face" in final[name]:
-                for index in final[name]["face"]:
+            if final[name].face is not None:
+                for index in final[name].face:
                     var_name = ""
                     var_name += "f_{" + str(int(index))
-                    if len(bpy.context.selected_objects) > 1:
+                    if object_total > 1:
                         if not op.use_names:
                             var_name += "Faces"
                         var_name += f"{prefix}"
                     elif op.use_names:
                         var_name += f"{prefix}"
                     var_name += "}"  
-                    file_push(var_name, final[name]["face"][index])
+                    # faces with fewer corners are padded with 0, which desmos needs to see as infinity
+                    face_column = final[name].face[index]
+                    file_push(var_name, np.where(face_column == 0, math.inf, face_column))
             
-                if "midpoint" in final[name]:
-                    for axis in final[name]["midpoint"]:
+                if final[name].midpoint is not None:
+                    for axis in final[name].midpoint:
                         var_name = ""
                         var_name += f"{axis}_"
                         var_name += "{Midpoints" + f"{prefix}" + "}"
-                        file_push(var_name, final[name]["midpoint"][axis])
+                        file_push(var_name, final[name].midpoint[axis])
                         
                 
-                if "normal" in final[name]:
-                    for axis in final[name]["normal"]:
+                if final[name].normal is not None:
+                    for axis in final[name].normal:
                         var_name = ""
                         var_name += f"{axis}_"
                         var_name += "{Normals" + f"{prefix}" + "}"
-                        file_push(var_name, final[name]["normal"][axis])
+                        file_push(var_name, final[name].normal[axis])
                 
-                if "material" in final[name]:
+                if final[name].material is not None:
                     var_name = ""
                     var_name += "m_{Materials"
                     var_name += f"{prefix}" + "}"
-                    file_push(var_name, final[name]["material"])
+                    file_push(var_name, final[name].material)
                 
-        if "loc" in final[name]:
-            for axis in final[name]["loc"]:
+                if final[name].color is not None:
+                    var_name = ""
+                    var_name += "c_{Colors"
+                    var_name += f"{prefix}" + "}"
+                    file_push(var_name, final[name].color)
+            
+            if final[name].edge is not None:
+                for index in final[name].edge:
+                    var_name = ""
+                    var_name += "e_{" + str(int(index))
+                    if object_total > 1:
+                        if not op.use_names:
+                            var_name += "Edges"
+                        var_name += f"{prefix}"
+                    elif op.use_names:
+                        var_name += f"{prefix}"
+                    var_name += "}"
+                    file_push(var_name, final[name].edge[index])
+                
+        if final[name].loc is not None:
+            for axis in final[name].loc:
                 var_name = ""
                 var_name += f"{axis}_"
                 var_name += "{Location" + f"{prefix}" + "}"
-                file_push(var_name, final[name]["loc"][axis])
+                file_push(var_name, final[name].loc[axis])
         
-        if "rot" in final[name]:
-            for axis in final[name]["rot"]:
+        if final[name].rot is not None:
+            for axis in final[name].rot:
                 var_name = ""
                 var_name += f"{axis}_"
                 var_name += "{Rotation" + f"{prefix}" + "}"
-                file_push(var_name, final[name]["rot"][axis])
+                file_push(var_name, final[name].rot[axis])
         
-        if "scale" in final[name]:
-            for axis in final[name]["scale"]:
+        if final[name].scale is not None:
+            for axis in final[name].scale:
                 var_name = ""
                 var_name += f"{axis}_"
                 var_name += "{Scale" + f"{prefix}" + "}"
-                file_push(var_name, final[name]["scale"][axis])
+                file_push(var_name, final[name].scale[axis])
+                
+        if final[name].matrix is not None:
+            for index in final[name].matrix:
+                var_name = ""
+                var_name += "m_{" + index
+                var_name += "Transform" + f"{prefix}" + "}"
+                file_push(var_name, final[name].matrix[index])
+        
+        if final[name].bake is not None:
+            for frame_index in final[name].bake:
+                for axis in final[name].bake[frame_index]:
+                    var_name = ""
+                    var_name += f"{axis}_"
+                    var_name += "{Frame" + f"{frame_index}" + "Vertices" + f"{prefix}" + "}"
+                    file_push(var_name, final[name].bake[frame_index][axis])
+                
+        if final[name].deform is not None:
+            for frame_index in final[name].deform:
+                var_name = ""
+                var_name += "i_{Frame" + f"{frame_index}" + "Deform" + f"{prefix}" + "}"
+                file_push(var_name, final[name].deform_index[frame_index])
                 
+                if final[name].deform[frame_index] is None:
+                    continue
+                for axis in final[name].deform[frame_index]:
+                    var_name = ""
+                    var_name += f"{axis}_"
+                    var_name += "{Frame" + f"{frame_index}" + "Deform" + f"{prefix}" + "}"
+                    file_push(var_name, final[name].deform[frame_index][axis])
+                
+        # the palette is much shorter than the other columns, so it gets a table of its own
+        if final[name].palette is not None:
+            if op.type_output == "JSON":
+                final_json.append({"type": "table", "columns": [], "folderId": "#folderId", "id": "#Calc.controller.generateId()"})
+            elif op.type_output == "PATCH":
+                final_json.append({"type": "table", "columns": [], "folderId": final_json[0]["id"], "id": stable_id(f"{id_scope}/{name}/palette")})
+            for channel in final[name].palette:
+                var_name = ""
+                var_name += f"{channel}_"
+                var_name += "{Palette" + f"{prefix}" + "}"
+                file_push(var_name, final[name].palette[channel])
+        
         if op.type_output == "TXT":
             console += "\n"
     
@@ -757,7 +1569,11 @@ def export_desmos(op, context):
         console = "/* TIP: Here is an example of how you would use this add-on:\nhttps://www.desmos.com/calculator/u6xbg2i0xa\n*/\n\n" + console
     # at this point, `console` should be empty if JSON mode is enabled. time to finally use the Desmos API in its fullest
     if op.type_output == "JSON":
-        dump = json.dumps(final_json)
+        # shards go into the folder that their index file already created
+        if is_shard:
+            dump = dump_expressions(final_json[1:])
+        else:
+            dump = dump_expressions(final_json)
         dump = dump.replace('"id": "#Calc.controller.generateId()"', '"id": Calc.controller.generateId()')
         dump = dump.replace('"folderId": "#folderId"', '"folderId": folderId')
         dump = dump.replace('"id": "#folderId"', '"id": folderId')
@@ -785,16 +1601,88 @@ Enjoy!
 */
 
 folderId = Calc.controller.generateId();\nblender = {dump};\n"""
+        if is_shard:
+            console = console.replace("folderId = Calc.controller.generateId();\n", 'if (typeof folderId === "undefined") {throw new Error("Paste the index file of this export first.");}\n')
         console += """state = Calc.getState();
 for (const expression of blender) {state.expressions.list.push(expression);}
 Calc.setState(state);"""
+    
+    # a patch only carries the expressions and columns whose hashes differ from the previous manifest
+    if op.type_output == "PATCH":
+        previous_expressions = {}
+        if previous_manifest is not None:
+            previous_expressions = previous_manifest["expressions"]
+        
+        manifest = {"expressions": {}}
+        patch = {"upsert": [], "remove": []}
+        for expression in final_json:
+            previous = previous_expressions.get(expression["id"])
+            
+            if expression["type"] == "table":
+                columns = {}
+                for column in expression["columns"]:
+                    columns[column["id"]] = hashlib.sha1(column["json"].encode("utf-8")).hexdigest()
+                manifest["expressions"][expression["id"]] = {"type": "table", "columns": columns}
+                
+                previous_columns = {}
+                if previous is not None and previous["type"] == "table":
+                    previous_columns = previous["columns"]
+                changed_columns = [column for column in expression["columns"] if previous_columns.get(column["id"]) != columns[column["id"]]]
+                stale_columns = [column_id for column_id in previous_columns if column_id not in columns]
+                
+                if previous is None or changed_columns or stale_columns:
+                    table = dict(expression)
+                    table["columns"] = changed_columns
+                    patch["upsert"].append({"expression": table, "removeColumns": stale_columns})
+            else:
+                current_hash = expression_hash(expression)
+                manifest["expressions"][expression["id"]] = {"type": expression["type"], "hash": current_hash}
+                
+                if previous is None or previous.get("hash") != current_hash:
+                    patch["upsert"].append({"expression": expression, "removeColumns": []})
+        
+        for expression_id in previous_expressions:
+            if expression_id not in manifest["expressions"]:
+                patch["remove"].append(expression_id)
+        
+        dump = dump_patch(patch)
+        console = f"""// ----------------- DISCLAIMER -------------------
+// WARNING: It is EXTREMELY unsafe to inject unverified code like this into your browser. Please read the code CAREFULLY before you are ready to proceed with the injection.
+// P.S. This will modify any unsaved graph in progress! You cannot undo this operation.
 
 
-    output_code = 0
-    if is_face_too_large:
-        output_code = 1
+/* INSTRUCTIONS
+This is a patch. It only contains what changed since the last export to this file ({len(patch["upsert"])} updated, {len(patch["remove"])} removed).
+
+1. Open your browser console (Hit F12 on your keyboard, or right click -> Inspect Element -> Console)
+2. Paste these contents into your console field.
+3. Hit enter.
+4. The graph is now updated!
+
+Every expression keeps the same id between exports, so the patch finds the old tables in the graph and only replaces the columns that changed.
+Patches build on each other. If you skip pasting one, or start over in a new graph, delete the `.manifest.json` file next to this one and export again.
+
+Enjoy!
+*/
+
+patch = {dump};
+"""
+        console += """state = Calc.getState();
+state.expressions.list = state.expressions.list.filter(expression => !patch.remove.includes(expression.id));
+for (const update of patch.upsert) {
+  const index = state.expressions.list.findIndex(expression => expression.id === update.expression.id);
+  if (index < 0) {state.expressions.list.push(update.expression); continue;}
+  if (update.expression.type !== "table") {state.expressions.list[index] = update.expression; continue;}
+  const columns = state.expressions.list[index].columns.filter(column => !update.removeColumns.includes(column.id));
+  for (const column of update.expression.columns) {
+    const position = columns.findIndex(current => current.id === column.id);
+    if (position < 0) {columns.push(column);} else {columns[position] = column;}
+  }
+  state.expressions.list[index] = {...update.expression, columns: columns};
+}
+Calc.setState(state);"""
 
-    return [console, output_code]
+    return [console, manifest]
 
 
 